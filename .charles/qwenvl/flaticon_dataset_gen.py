@@ -1,44 +1,273 @@
 import os
+import asyncio
 import sqlite3
+import threading
 from datetime import datetime
 import litellm
+import aiosqlite
 from pathlib import Path
-import base64
+import binascii
 import contextlib
+import errno
+import functools
+import heapq
+import mmap
+import itertools
+import json
+import logging
+import logging.handlers
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+def _is_image_name(name, suffixes, extension_set):
+    """Check a file name against the image extensions"""
+    # Exact-case endswith first: it makes no copies and matches the usual
+    # lowercase '.png', so only other names pay for a lowercased extension
+    if name.endswith(suffixes):
+        return True
+    # Without a dot, rpartition hands back the whole name, e.g. a file called 'png'
+    _, sep, extension = name.rpartition('.')
+    return sep == '.' and extension.lower() in extension_set
+
+def _scan_image_files(folder, suffixes, extension_set):
+    """Yield a sorted list of image files for folder and then for each folder below it"""
+    image_files = []
+    subfolders = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subfolders.append(entry.path)
+            elif entry.is_file() and _is_image_name(entry.name, suffixes, extension_set):
+                image_files.append(entry.path)
+    image_files.sort()
+    yield image_files
+    for subfolder in subfolders:
+        yield from _scan_image_files(subfolder, suffixes, extension_set)
+
+def _walk_collection(folder, suffixes, extension_set):
+    """Get all image files under one collection folder in sorted order, run in a worker process"""
+    return list(heapq.merge(*_scan_image_files(folder, suffixes, extension_set)))
+
+ImageMetadata = namedtuple('ImageMetadata', ['collection', 'type', 'file', 'filename'])
+
+@functools.lru_cache(maxsize=None)
+def _parse_image_path(image_path):
+    """Parse image path to extract metadata"""
+    # e.g., '../.data/flaticon.com/_corrupt/train/134332-business-set/png/atm-1.png'
+    parts = image_path.rsplit(os.sep, 3)
+    collection_folder = parts[-3]  # '134332-business-set'
+    type_folder = parts[-2]        # 'png'
+    filename = parts[-1]           # 'atm-1.png'
+    
+    # Extract filename without extension
+    file_base = filename.rsplit('.', 1)[0]  # 'atm-1'
+    
+    return ImageMetadata(collection_folder, type_folder, file_base, filename)
+
+@functools.lru_cache(maxsize=4096)
+def _split_collection(collection):
+    """Split a collection folder name into its number and name"""
+    # e.g., '134332-business-set' -> ('134332', 'business-set')
+    collection_parts = collection.split('-', 1)
+    collection_num = collection_parts[0]
+    collection_name = collection_parts[1] if len(collection_parts) > 1 else ""
+    return collection_num, collection_name
+
+# Returned in place of a description for images that should be marked skipped
+# rather than retried on the next run
+SKIPPED = object()
+
+# Read errors that won't go away by trying again later; anything else
+# (EIO, EMFILE, ...) leaves the record to be retried on the next run
+PERMANENT_ERRNOS = frozenset({errno.ENOENT, errno.EISDIR})
+
+# Leading bytes of the formats qwen2.5vl can decode: PNG, JPEG, GIF, BMP.
+# SVGs, including ones saved under an image extension, match none of them.
+IMAGE_SIGNATURES = (b'\x89PNG\r\n\x1a\n', b'\xff\xd8\xff', b'GIF87a', b'GIF89a', b'BM')
+SIGNATURE_LENGTH = max(len(signature) for signature in IMAGE_SIGNATURES)
+
+def _has_image_signature(header):
+    """Check the first SIGNATURE_LENGTH bytes of a file against IMAGE_SIGNATURES"""
+    return bytes(header).startswith(IMAGE_SIGNATURES)
+
+# The start of a single-image reply's description, however far the model got,
+# stopping short of a half-written escape such as a lone backslash or "\u00"
+_DESCRIPTION_PREFIX = re.compile(r'"description"\s*:\s*"((?:[^"\\]|\\u[0-9a-fA-F]{4}|\\[^u])*)')
+# Everything up to the last word break, dropping the word the cut landed in
+_COMPLETE_WORDS = re.compile(r'.*[\s,]', re.DOTALL)
+
+def _parse_description(content):
+    """Get the description string out of a single-image JSON reply, or None if there isn't one"""
+    if not isinstance(content, str):
+        return None
+    try:
+        reply = json.loads(content)
+    except ValueError:
+        # Cut off by max_tokens mid-string: keep the complete words written
+        # rather than retry the image on every run for the same truncated reply
+        match = _DESCRIPTION_PREFIX.search(content)
+        if not match:
+            return None
+        try:
+            partial = json.loads(f'"{match.group(1)}"')
+        except ValueError:
+            return None
+        words = _COMPLETE_WORDS.match(partial)
+        return (words and words.group().rstrip(' \t\n,;:-')) or None
+    if isinstance(reply, dict) and isinstance(reply.get("description"), str):
+        return reply["description"]
+    return None
+
+# Files at least this big are encoded straight from a memory map
+MMAP_THRESHOLD = 64 * 1024
+
+def _image_to_base64(image_path):
+    """Read and base64-encode an image file, run in a worker process"""
+    with open(image_path, "rb") as image_file:
+        if os.fstat(image_file.fileno()).st_size < MMAP_THRESHOLD:
+            data = image_file.read()
+            if not _has_image_signature(data[:SIGNATURE_LENGTH]):
+                raise ValueError(f"{image_path} is not a PNG, JPEG, GIF or BMP image")
+            return binascii.b2a_base64(data, newline=False).decode('ascii')
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if not _has_image_signature(mapped[:SIGNATURE_LENGTH]):
+                raise ValueError(f"{image_path} is not a PNG, JPEG, GIF or BMP image")
+            return binascii.b2a_base64(mapped, newline=False).decode('ascii')
 
 class FlaticonDatasets:
     # Constants
     DEFAULT_BASE_FOLDER = "../.data/flaticon.com/target/train"
     DEFAULT_DB_FILE = "../.data/flaticon_vision_text.sqlite3"
     DEFAULT_MODEL = "ollama/qwen2.5vl"
+    DEFAULT_LOG_FILE = "../.data/flaticon_dataset_gen.log"
     IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.svg')
+    # Lowercase extensions without the dot, for set lookups while walking
+    IMAGE_EXTENSION_SET = frozenset(ext[1:] for ext in IMAGE_EXTENSIONS)
+    # Images qwen2.5vl can't read, or that are too big to be worth sending,
+    # are marked skipped as soon as they're scanned
+    UNSUPPORTED_EXTENSION_SET = frozenset({'svg'})
+    MAX_IMAGE_BYTES = 5 * 1024 * 1024
     DEFAULT_BATCH_SIZE = 10
     PROCESSING_COUNT_ID = 0
+    # Requests kept in flight against the vision model. Ollama only serves them
+    # in parallel up to its OLLAMA_NUM_PARALLEL server setting (and loads at most
+    # OLLAMA_MAX_LOADED_MODELS models at once), so tune both together; see
+    # _default_concurrency. DEFAULT_CONCURRENCY applies when it isn't set.
+    DEFAULT_CONCURRENCY = 4
+    # Images packed into a single vision request; qwen2.5vl degrades past a
+    # handful of images per prompt, so cap it regardless of what's asked for
+    DEFAULT_VISION_BATCH_SIZE = 4
+    MAX_IMAGES_PER_REQUEST = 8
+    # Groups encoded ahead of time, beyond those holding a request slot, so the
+    # next request is ready as soon as one returns
+    PREFETCH_DEPTH = 2
+    # Unprocessed records read per query, independent of the commit batch size
+    UNPROCESSED_PAGE_SIZE = 256
+    # Decode time dominates local inference, so cap each description's length
+    MAX_DESCRIPTION_TOKENS = 60
+    TEMPERATURE = 0.2
+    
+    # WAL mode is persisted in the database file by _init_database, but these
+    # are per-connection settings: fewer fsyncs, temp tables in RAM, a 64MB page
+    # cache, 256MB of memory-mapped I/O, rarer checkpoints, and waiting on a
+    # locked database instead of failing straight away
+    CONNECTION_PRAGMAS = '''
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
+        PRAGMA wal_autocheckpoint=2000;
+        PRAGMA busy_timeout=5000;
+    '''
+    # Statements on the hot scan and write paths. sqlite3 (and aiosqlite on top
+    # of it) caches prepared statements per connection keyed on the SQL text, so
+    # keeping each one as a single constant means it is only ever parsed once.
+    SQL_UPDATE_SCAN = 'UPDATE flaticon_images SET scanned_when = ? WHERE image_path = ?'
+    SQL_SKIP_UNSUPPORTED = 'UPDATE flaticon_images SET skipped = 1 WHERE image_path = ? AND updated_when IS NULL'
+    SQL_INSERT = '''
+        INSERT INTO flaticon_images 
+        (collection, type, file, filename, image_path, skipped, created_when, scanned_when)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    SQL_SELECT_UNPROCESSED = '''
+        SELECT id, image_path, collection FROM flaticon_images 
+        WHERE updated_when IS NULL AND skipped = 0 AND id > ?
+        ORDER BY id
+        LIMIT ?
+    '''
+    SQL_MARK_PROCESSED = 'UPDATE flaticon_images SET model = ?, text = ?, updated_when = ? WHERE id = ?'
+    SQL_MARK_SKIPPED = 'UPDATE flaticon_images SET skipped = 1 WHERE id = ?'
+    SQL_SAVE_LAST_PROCESSED = 'UPDATE processing_count SET image_path = ?, updated_when = ? WHERE id = 0'
+    # Vision prompts, %-formatted per image (or per batch) at call time
+    PROMPT_TEMPLATE = """
+This is from Flaticon.com Collection #%(num)s \"%(name)s\", %(file)s %(type)s.
+Describe what's in this image in a very very concise way, pay attention to the designer's original intention for a %(file)s logo,
+under the collection of \"%(name)s\"), only mention if details like color scheme, lines, layout, style, etc warrant mentioning. 
+Don't use full sentence, more like a description from an art gallery description for a painting.
+Reply with JSON only: {"description": "..."}
+"""
+    BATCH_PROMPT_TEMPLATE = """
+These %(count)d images are from Flaticon.com Collection #%(num)s \"%(name)s\", in this order:
+%(images)s
+Describe what's in each image in a very very concise way, pay attention to the designer's original intention for each logo,
+under the collection of \"%(name)s\", only mention if details like color scheme, lines, layout, style, etc warrant mentioning. 
+Don't use full sentence, more like a description from an art gallery description for a painting.
+Reply with JSON only, one description per image keyed by its number: {"1": "...", "2": "..."}
+"""
     
-    def __init__(self, base_folder=None, db_file=None):
+    def __init__(self, base_folder=None, db_file=None, concurrency=None, vision_batch_size=None):
         self.base_folder = base_folder or self.DEFAULT_BASE_FOLDER
         self.db_file = db_file or self.DEFAULT_DB_FILE
         self.model = self.DEFAULT_MODEL
+        self.concurrency = concurrency or self._default_concurrency()
+        # Worker pool encoding images off the event loop while processing
+        self._encode_pool = None
+        self.vision_batch_size = min(
+            vision_batch_size or self.DEFAULT_VISION_BATCH_SIZE,
+            self.MAX_IMAGES_PER_REQUEST
+        )
+        # One long-lived database connection per thread, see _get_db_connection
+        self._tls = threading.local()
         self._init_database()
     
+    def _default_concurrency(self):
+        """Match OLLAMA_NUM_PARALLEL when it is set to a positive number"""
+        try:
+            concurrency = int(os.getenv('OLLAMA_NUM_PARALLEL', ''))
+        except ValueError:
+            return self.DEFAULT_CONCURRENCY
+        return concurrency if concurrency > 0 else self.DEFAULT_CONCURRENCY
+    
     @contextlib.contextmanager
     def _get_db_connection(self):
-        """Context manager for database connections with proper cleanup"""
-        conn = sqlite3.connect(self.db_file)
-        # Enable WAL mode for better crash resistance
-        conn.execute('PRAGMA journal_mode=WAL')
-        conn.execute('PRAGMA synchronous=NORMAL')
+        """Context manager for this thread's database connection, rolling back on errors"""
+        # The connection is opened once per thread and reused until close()
+        conn = getattr(self._tls, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_file)
+            conn.executescript(self.CONNECTION_PRAGMAS)
+            self._tls.conn = conn
         try:
             yield conn
         except Exception:
             conn.rollback()
             raise
-        finally:
+    
+    def close(self):
+        """Close this thread's database connection, if one is open"""
+        conn = getattr(self._tls, 'conn', None)
+        if conn is not None:
             conn.close()
+            self._tls.conn = None
     
     def _init_database(self):
         """Initialize SQLite database with required schema"""
         with self._get_db_connection() as conn:
+            # Enable WAL mode for better crash resistance, once; it sticks to the file
+            conn.execute('PRAGMA journal_mode=WAL')
             cursor = conn.cursor()
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS flaticon_images (
@@ -62,6 +291,13 @@ class FlaticonDatasets:
             except sqlite3.OperationalError:
                 # Column already exists
                 pass
+            # Partial index covering just the rows still waiting for the vision
+            # model, so the unprocessed query is a range scan, not a full scan.
+            # image_path lookups already use the index behind its UNIQUE constraint.
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_unprocessed ON flaticon_images(id)
+                WHERE updated_when IS NULL AND skipped = 0
+            ''')
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS processing_count (
                     id INTEGER PRIMARY KEY CHECK (id = 0),
@@ -81,214 +317,429 @@ class FlaticonDatasets:
             result = cursor.fetchone()
             return result[0] if result and result[0] else None
     
-    def _save_last_processed(self, image_path):
-        """Save the last processed image path to database"""
-        with self._get_db_connection() as conn:
-            cursor = conn.cursor()
-            current_time = datetime.now()
-            cursor.execute(
-                'UPDATE processing_count SET image_path = ?, updated_when = ? WHERE id = 0',
-                (image_path, current_time)
-            )
-            conn.commit()
+    async def _asave_last_processed(self, db, image_path):
+        """Save the last processed image path on the caller's connection, inside its transaction"""
+        current_time = datetime.now()
+        await db.execute(self.SQL_SAVE_LAST_PROCESSED, (image_path, current_time))
     
     def _get_image_files(self):
-        """Get all image files from the base folder"""
+        """Get all image files from the base folder, walking each collection folder in parallel"""
         image_files = []
-        for root, dirs, files in os.walk(self.base_folder):
-            for file in files:
-                if file.lower().endswith(self.IMAGE_EXTENSIONS):
-                    image_files.append(os.path.join(root, file))
-        return sorted(image_files)  # Sort for consistent ordering
-    
-    def _parse_image_path(self, image_path):
-        """Parse image path to extract metadata"""
-        # e.g., '../.data/flaticon.com/_corrupt/train/134332-business-set/png/atm-1.png'
-        parts = image_path.split('/')
-        collection_folder = parts[-3]  # '134332-business-set'
-        type_folder = parts[-2]        # 'png'
-        filename = parts[-1]           # 'atm-1.png'
-        
-        # Extract filename without extension
-        file_base = filename.rsplit('.', 1)[0]  # 'atm-1'
+        collection_folders = []
+        with os.scandir(self.base_folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    collection_folders.append(entry.path)
+                elif entry.is_file() and _is_image_name(entry.name, self.IMAGE_EXTENSIONS, self.IMAGE_EXTENSION_SET):
+                    image_files.append(entry.path)
+        image_files.sort()
         
-        return {
-            'collection': collection_folder,
-            'type': type_folder,
-            'file': file_base,
-            'filename': filename
-        }
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+            collection_files = list(pool.map(
+                _walk_collection,
+                collection_folders,
+                itertools.repeat(self.IMAGE_EXTENSIONS),
+                itertools.repeat(self.IMAGE_EXTENSION_SET)
+            ))
+        # Every list is already sorted, so merge them for consistent ordering
+        return list(heapq.merge(image_files, *collection_files))
     
-    def _image_to_base64(self, image_path):
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-        return base64_image 
+    async def _aimage_to_base64(self, image_path):
+        """Encode an image in the worker pool so encoding overlaps with inference"""
+        # Encoding can't be skipped for a local Ollama: its HTTP API only takes
+        # base64 image data and never reads file paths or file:// URLs itself
+        # (the ollama Python client accepts paths but encodes them client-side)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._encode_pool, _image_to_base64, image_path)
 
     def _create_prompt(self, image_path):
         """Create prompt text for vision model"""
-        metadata = self._parse_image_path(image_path)
-        collection_parts = metadata['collection'].split('-', 1)
-        collection_num = collection_parts[0]
-        collection_name = collection_parts[1] if len(collection_parts) > 1 else ""
+        metadata = _parse_image_path(image_path)
+        collection_num, collection_name = _split_collection(metadata.collection)
         
-        return f"""
-This is from Flaticon.com Collection #{collection_num} \"{collection_name}\", {metadata['file']} {metadata['type']}.
-Describe what's in this image in a very very concise way, pay attention to the designer's original intention for a {metadata['file']} logo,
-under the collection of \"{collection_name}\"), only mention if details like color scheme, lines, layout, style, etc warrant mentioning. 
-Don't use full sentence, more like a description from an art gallery description for a painting.
-"""
+        return self.PROMPT_TEMPLATE % {
+            'num': collection_num,
+            'name': collection_name,
+            'file': metadata.file,
+            'type': metadata.type,
+        }
+    
+    def _create_batch_prompt(self, image_paths):
+        """Create prompt text asking for one description per image, as JSON"""
+        # All images of a batch share the same collection
+        metadata = [_parse_image_path(image_path) for image_path in image_paths]
+        collection_num, collection_name = _split_collection(metadata[0].collection)
+        image_list = "\n".join(
+            f"{i}. {m.file} {m.type}" for i, m in enumerate(metadata, start=1)
+        )
+        
+        return self.BATCH_PROMPT_TEMPLATE % {
+            'count': len(image_paths),
+            'num': collection_num,
+            'name': collection_name,
+            'images': image_list,
+        }
+    
+    async def _acomplete(self, prompt_text, base64_images):
+        """Send one prompt with its images to the vision model and return the reply text"""
+        content = [{"type": "text", "text": prompt_text}]
+        for base64_image in base64_images:
+            content.append({
+                "type": "image_url",
+                "image_url": {
+                    "url": base64_image
+                }
+            })
+        
+        response = await litellm.acompletion(
+            model=self.model,
+            messages=[{"role": "user", "content": content}],
+            response_format={"type": "json_object"},
+            max_tokens=self.MAX_DESCRIPTION_TOKENS * len(base64_images),
+            temperature=self.TEMPERATURE,
+        )
+        
+        return response.choices[0].message.content
     
-    def _process_image(self, image_path):
-        """Process a single image with the vision model"""
+    async def _aprocess_image(self, image_path, base64_image=None):
+        """Process a single image with the vision model, encoding it unless already encoded"""
         try:
-            base64_image = self._image_to_base64(image_path)
-            prompt_text = self._create_prompt(image_path)
-            
-            response = litellm.completion(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": prompt_text
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": base64_image
-                                }
-                            }
-                        ]
-                    }
-                ],
-            )
-            
-            return response.choices[0].message.content
+            if base64_image is None:
+                base64_image = await self._aimage_to_base64(image_path)
+            elif isinstance(base64_image, Exception):
+                # Encoding ahead of time failed
+                raise base64_image
+        except ValueError as e:
+            logger.warning("Undecodable image %s: %s", image_path, e)
+            return SKIPPED
+        except OSError as e:
+            if e.errno in PERMANENT_ERRNOS:
+                logger.warning("Unreadable image %s: %s", image_path, e)
+                return SKIPPED
+            logger.warning("Error reading %s, will retry: %s", image_path, e)
+            return None
         except Exception as e:
-            print(f"Error processing {image_path}: {e}")
+            logger.warning("Error encoding %s: %s", image_path, e)
             return None
+        
+        try:
+            content = await self._acomplete(self._create_prompt(image_path), [base64_image])
+        except Exception as e:
+            # Model errors, including HTTP 400s, can come from configuration
+            # (unsupported params, context window) rather than the image, so
+            # leave the record for the next run instead of marking it skipped
+            logger.warning("Error processing %s: %s", image_path, e)
+            return None
+        
+        description = _parse_description(content)
+        if description is None:
+            logger.warning("Unusable reply for %s: %r", image_path, content)
+        return description
+    
+    async def _aencode_images(self, image_paths):
+        """Encode images concurrently, returning the exception in place of any that fail"""
+        return await asyncio.gather(
+            *(self._aimage_to_base64(image_path) for image_path in image_paths),
+            return_exceptions=True
+        )
+    
+    async def _aprocess_images(self, image_paths, base64_images=None):
+        """Process a batch of same-collection images with one vision model request"""
+        if base64_images is None:
+            base64_images = await self._aencode_images(image_paths)
+        
+        if len(image_paths) == 1 or any(isinstance(b, Exception) for b in base64_images):
+            # Let each image report its own encoding failure
+            return [
+                await self._aprocess_image(image_path, base64_image)
+                for image_path, base64_image in zip(image_paths, base64_images)
+            ]
+        
+        try:
+            content = await self._acomplete(self._create_batch_prompt(image_paths), base64_images)
+            descriptions = json.loads(content)
+            if not isinstance(descriptions, dict):
+                raise ValueError(f"expected a JSON object, got {type(descriptions).__name__}")
+            results = [descriptions.get(str(i)) for i in range(1, len(image_paths) + 1)]
+            if not all(isinstance(result, str) for result in results):
+                raise ValueError("reply is missing a description or has a non-string one")
+            return results
+        except (ValueError, TypeError, litellm.BadRequestError) as e:
+            # One bad image, or too many for the context window, fails the whole
+            # batch, so try them one by one. json.JSONDecodeError is a ValueError.
+            logger.warning("Retrying batch starting at %s one image at a time: %s", image_paths[0], e)
+            return [
+                await self._aprocess_image(image_path, base64_image)
+                for image_path, base64_image in zip(image_paths, base64_images)
+            ]
+        except Exception as e:
+            logger.warning("Error processing batch starting at %s: %s", image_paths[0], e)
+            return [None] * len(image_paths)
+    
+    def _group_by_collection(self, records):
+        """Split (id, image_path, collection) records into same-collection groups of up to vision_batch_size"""
+        groups = []
+        for _, collection_records in itertools.groupby(records, key=lambda r: r[2]):
+            collection_records = list(collection_records)
+            for i in range(0, len(collection_records), self.vision_batch_size):
+                groups.append(collection_records[i:i+self.vision_batch_size])
+        return groups
+    
+    def _is_unsupported(self, image_path):
+        """Check whether an image is of a type the vision model can't read, or too big to send"""
+        if image_path.rpartition('.')[2].lower() in self.UNSUPPORTED_EXTENSION_SET:
+            return True
+        try:
+            if os.path.getsize(image_path) > self.MAX_IMAGE_BYTES:
+                return True
+            # Sniff the header, which also catches SVGs saved as .png and empty files
+            with open(image_path, "rb") as image_file:
+                return not _has_image_signature(image_file.read(SIGNATURE_LENGTH))
+        except OSError:
+            # Can't tell right now; leave it to processing rather than skip it for good
+            return False
     
     def _scan_and_update_database(self):
         """Scan image files and update database with timestamps"""
         image_files = self._get_image_files()
         current_time = datetime.now()
         
-        print(f"Scanning {len(image_files)} image files...")
+        logger.info("Scanning %d image files...", len(image_files))
         
         with self._get_db_connection() as conn:
             cursor = conn.cursor()
             
-            # Process in batches to avoid long transactions
-            batch_size = 100
-            for i in range(0, len(image_files), batch_size):
-                batch = image_files[i:i+batch_size]
-                
-                for image_path in batch:
-                    metadata = self._parse_image_path(image_path)
-                    
-                    # Check if file exists in database
-                    cursor.execute('SELECT id FROM flaticon_images WHERE image_path = ?', (image_path,))
-                    existing = cursor.fetchone()
-                    
-                    if existing:
-                        # Update scanned_when for existing file
-                        cursor.execute(
-                            'UPDATE flaticon_images SET scanned_when = ? WHERE image_path = ?',
-                            (current_time, image_path)
-                        )
-                    else:
-                        # Insert new file with created_when and scanned_when
-                        cursor.execute('''
-                            INSERT INTO flaticon_images 
-                            (collection, type, file, filename, image_path, created_when, scanned_when)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                        ''', (
-                            metadata['collection'],
-                            metadata['type'], 
-                            metadata['file'],
-                            metadata['filename'],
-                            image_path,
-                            current_time,
-                            current_time
-                        ))
-                
-                # Commit each batch
-                conn.commit()
-                print(f"Processed batch {i//batch_size + 1}/{(len(image_files) + batch_size - 1)//batch_size}")
+            # Diff the files on disk against the paths already known, in memory,
+            # instead of looking each file up in the database. Each known path
+            # maps to whether it is still waiting for the vision model.
+            existing = dict(cursor.execute(
+                'SELECT image_path, updated_when IS NULL AND skipped = 0 FROM flaticon_images'
+            ))
+            to_update = [image_path for image_path in image_files if image_path in existing]
+            to_insert = [image_path for image_path in image_files if image_path not in existing]
+            
+            # Update scanned_when for existing files
+            cursor.executemany(
+                self.SQL_UPDATE_SCAN,
+                [(current_time, image_path) for image_path in to_update]
+            )
+            
+            # Mark existing, still unprocessed files skipped if the vision model can't take them
+            to_skip = [
+                image_path for image_path in to_update
+                if existing[image_path] and self._is_unsupported(image_path)
+            ]
+            cursor.executemany(self.SQL_SKIP_UNSUPPORTED, [(image_path,) for image_path in to_skip])
+            
+            # Insert new files with created_when and scanned_when, in sorted order,
+            # already marked skipped if the vision model can't take them
+            rows = []
+            for image_path in to_insert:
+                skipped = int(self._is_unsupported(image_path))
+                rows.append((*_parse_image_path(image_path), image_path, skipped, current_time, current_time))
+            cursor.executemany(self.SQL_INSERT, rows)
+            
+            conn.commit()
+            skipped_count = sum(row[5] for row in rows)
+            logger.info(
+                "Updated %d existing (%d newly skipped) and inserted %d new records (%d skipped)",
+                len(to_update), len(to_skip), len(to_insert), skipped_count
+            )
+            
+            # Refresh planner statistics now the table contents have changed
+            cursor.execute('ANALYZE')
         
-        print("Database scanning complete!")
+        logger.info("Database scanning complete!")
     
-    def _process_unprocessed_records(self, batch_size=None):
+    async def _aflush_pending(self, db, pending, skipped_ids, last_image_path):
+        """Write pending (model, text, updated_when, id) updates, skipped ids and the last processed record in one transaction"""
+        try:
+            if pending:
+                await db.executemany(self.SQL_MARK_PROCESSED, pending)
+                await self._asave_last_processed(db, last_image_path)
+            await db.executemany(self.SQL_MARK_SKIPPED, [(record_id,) for record_id in skipped_ids])
+            await db.commit()
+        except Exception:
+            # Don't leave partial UPDATEs in the open transaction for the next commit
+            await db.rollback()
+            raise
+    
+    async def _aiter_unprocessed(self, db, page_size):
+        """Yield pages of unprocessed (id, image_path, collection) records that are not skipped"""
+        # Page by id rather than holding one SELECT open for the whole run: memory
+        # stays flat, and no read transaction stays open to hold back WAL
+        # checkpoints while the pages are being updated on the same connection
+        last_id = -1
+        while True:
+            async with db.execute(self.SQL_SELECT_UNPROCESSED, (last_id, page_size)) as cursor:
+                page = await cursor.fetchall()
+            if not page:
+                return
+            yield page
+            last_id = page[-1][0]
+    
+    async def _aiter_groups(self, db):
+        """Yield same-collection groups of unprocessed records, keeping groups whole across pages"""
+        carry = []
+        async for page in self._aiter_unprocessed(db, self.UNPROCESSED_PAGE_SIZE):
+            groups = self._group_by_collection(carry + page)
+            # The last group may continue on the next page, so hold it back unless full
+            carry = groups.pop() if len(groups[-1]) < self.vision_batch_size else []
+            for group in groups:
+                yield group
+        if carry:
+            yield carry
+    
+    async def _aprocess_unprocessed_records(self, batch_size=None):
         """Process records that don't have updated_when timestamp"""
         if batch_size is None:
             batch_size = self.DEFAULT_BATCH_SIZE
+        
+        # Bound the number of requests in flight against the model server, and
+        # the number of groups scheduled (in flight or encoded and waiting)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        scheduled = asyncio.Semaphore(self.concurrency + self.PREFETCH_DEPTH)
+        # Coroutines share one connection; only one may write and commit at a time
+        commit_lock = asyncio.Lock()
+        tasks = set()
+        failures = []
+        
+        processed_count = 0
+        pending = []
+        skipped_ids = []
+        last_image_path = None
+        
+        async def flush():
+            nonlocal pending, skipped_ids, processed_count
+            async with commit_lock:
+                if not (pending or skipped_ids):
+                    return
+                # Swap the lists out so results landing during the commit go to the next batch
+                batch, pending = pending, []
+                batch_skipped_ids, skipped_ids = skipped_ids, []
+                try:
+                    await self._aflush_pending(db, batch, batch_skipped_ids, last_image_path)
+                except Exception:
+                    # Put the batch back so the next flush writes it
+                    pending = batch + pending
+                    skipped_ids = batch_skipped_ids + skipped_ids
+                    raise
+                processed_count += len(batch)
+                logger.info("Processed %d/%d records so far...", processed_count, unprocessed_count)
+        
+        async def process(group):
+            nonlocal last_image_path
+            image_paths = [image_path for _, image_path, _ in group]
+            try:
+                # Encode before taking a request slot, overlapping with requests in flight
+                base64_images = await self._aencode_images(image_paths)
+                async with semaphore:
+                    for record_id, image_path, _ in group:
+                        logger.debug("Processing record %d: %s", record_id, image_path)
+                    vision_texts = await self._aprocess_images(image_paths, base64_images)
+            finally:
+                scheduled.release()
             
-        with self._get_db_connection() as conn:
-            cursor = conn.cursor()
+            current_time = datetime.now()
+            for (record_id, image_path, _), vision_text in zip(group, vision_texts):
+                if vision_text is SKIPPED:
+                    skipped_ids.append(record_id)
+                    logger.debug("Marked record %d as skipped", record_id)
+                elif vision_text:
+                    pending.append((self.model, vision_text, current_time, record_id))
+                    last_image_path = image_path
+                else:
+                    logger.debug("Skipped record %d due to processing error", record_id)
             
-            # Get unprocessed records that are not skipped
-            cursor.execute('''
-                SELECT id, image_path FROM flaticon_images 
-                WHERE updated_when IS NULL AND skipped = 0
-                ORDER BY id
-            ''')
-            unprocessed = cursor.fetchall()
+            if len(pending) + len(skipped_ids) >= batch_size:
+                await flush()
+        
+        def task_done(task):
+            tasks.discard(task)
+            # Keep failures rather than letting them vanish with the task
+            if not task.cancelled() and task.exception() is not None:
+                logger.error("Processing task failed", exc_info=task.exception())
+                failures.append(task.exception())
+        
+        async with aiosqlite.connect(self.db_file) as db:
+            await db.executescript(self.CONNECTION_PRAGMAS)
             
-            print(f"Found {len(unprocessed)} unprocessed records (excluding skipped)")
+            # Count unprocessed records that are not skipped
+            async with db.execute(
+                'SELECT COUNT(*) FROM flaticon_images WHERE updated_when IS NULL AND skipped = 0'
+            ) as cursor:
+                unprocessed_count = (await cursor.fetchone())[0]
             
-            processed_count = 0
-            for record_id, image_path in unprocessed:
-                print(f"Processing record {record_id}: {image_path}")
-                
-                try:
-                    # Process with vision model
-                    vision_text = self._process_image(image_path)
-                    
-                    if vision_text:
-                        # Update record with vision text in a separate transaction
-                        current_time = datetime.now()
-                        
-                        cursor.execute('''
-                            UPDATE flaticon_images 
-                            SET model = ?, text = ?, updated_when = ?
-                            WHERE id = ?
-                        ''', (self.model, vision_text, current_time, record_id))
-                        
-                        conn.commit()
-                        processed_count += 1
-                        
-                        # Update last processed record
-                        self._save_last_processed(image_path)
-                        
-                        if processed_count % batch_size == 0:
-                            print(f"Processed {processed_count} records so far...")
-                    else:
-                        print(f"Skipped record {record_id} due to processing error")
-                        
-                except Exception as e:
-                    print(f"Error processing record {record_id}: {e}")
-                    # Continue with next record instead of stopping
-                    continue
+            logger.info("Found %d unprocessed records (excluding skipped)", unprocessed_count)
+            
+            async for group in self._aiter_groups(db):
+                # Wait for a free slot before scheduling, so tasks never pile up
+                await scheduled.acquire()
+                if failures:
+                    # Stop scheduling new work once a task has failed
+                    scheduled.release()
+                    break
+                task = asyncio.create_task(process(group))
+                tasks.add(task)
+                task.add_done_callback(task_done)
             
-            print(f"Processing complete! Processed {processed_count} records.")
+            # Failures are collected by task_done
+            await asyncio.gather(*tasks, return_exceptions=True)
+            
+            # Flush whatever is left over from the last groups, or put back by a failed flush
+            await flush()
+            
+            if failures:
+                raise RuntimeError(
+                    f"{len(failures)} processing task(s) failed, processed {processed_count} records"
+                ) from failures[0]
+            
+            logger.info("Processing complete! Processed %d records.", processed_count)
+    
+    def _process_unprocessed_records(self, batch_size=None):
+        """Process records that don't have updated_when timestamp"""
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+            self._encode_pool = pool
+            try:
+                asyncio.run(self._aprocess_unprocessed_records(batch_size))
+            finally:
+                self._encode_pool = None
     
     def Generate(self, batch_size=None):
         """Main method to scan files and process unprocessed records"""
         if batch_size is None:
             batch_size = self.DEFAULT_BATCH_SIZE
             
-        print("Starting FlaticonDatasets processing...")
+        logger.info("Starting FlaticonDatasets processing...")
         
-        # Step 1: Scan files and update database
-        self._scan_and_update_database()
-        
-        # Step 2: Process unprocessed records
-        self._process_unprocessed_records(batch_size)
+        try:
+            # Step 1: Scan files and update database
+            self._scan_and_update_database()
+            
+            # Step 2: Process unprocessed records
+            self._process_unprocessed_records(batch_size)
+        finally:
+            self.close()
         
-        print("All processing complete!")
+        logger.info("All processing complete!")
+
+def _setup_logging(log_file):
+    """Log everything to a rotating file and only progress and problems to stderr"""
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=10 * 1024 * 1024, backupCount=3
+    )
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(message)s'))
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.setFormatter(logging.Formatter('%(message)s'))
+    
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(file_handler)
+    logger.addHandler(stream_handler)
 
 if __name__ == "__main__":
+    _setup_logging(FlaticonDatasets.DEFAULT_LOG_FILE)
     dataset = FlaticonDatasets()
     dataset.Generate()
\ No newline at end of file